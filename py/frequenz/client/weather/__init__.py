@@ -3,7 +3,21 @@
 
 """The Weather Forecast API client."""
 
-from ._client import Client
-from ._types import ForecastFeature, Forecasts, Location
+from ._client import Client, make_channel_pool
+from ._types import (
+    FORECAST_DATA_DTYPE,
+    ForecastFeature,
+    Forecasts,
+    HistoricalForecasts,
+    Location,
+)
 
-__all__ = ["Client", "ForecastFeature", "Forecasts", "Location"]
+__all__ = [
+    "FORECAST_DATA_DTYPE",
+    "Client",
+    "ForecastFeature",
+    "Forecasts",
+    "HistoricalForecasts",
+    "Location",
+    "make_channel_pool",
+]
@@ -3,6 +3,8 @@
 
 """The Weather Forecast API client."""
 
+import itertools
+from collections.abc import Sequence
 from datetime import datetime
 
 import grpc
@@ -14,20 +16,81 @@ from ._historical_forecast_iterator import HistoricalForecastIterator
 from ._types import ForecastFeature, Forecasts, Location
 
 
+def make_channel_pool(
+    svc_addr: str,
+    size: int,
+    credentials: grpc.ChannelCredentials | None = None,
+    keepalive_time_ms: int | None = None,
+) -> list[grpc.aio.Channel]:
+    """Create a pool of gRPC channels to the same service.
+
+    Each channel uses its own subchannel pool, so that the channels don't share
+    a single HTTP/2 connection, and with it its limit of concurrent streams.
+
+    Args:
+        svc_addr: Address of the service to connect to.
+        size: Number of channels to create.
+        credentials: Credentials to create secure channels with, if given.
+        keepalive_time_ms: Interval between keepalive pings on the channels, or
+            None to not send keepalive pings. The server must allow pings at
+            this interval: by default gRPC servers only accept a ping every
+            5 minutes while no data is flowing, and close the connection with
+            `too_many_pings` if they get them more often.
+
+    Returns:
+        The created channels.
+
+    Raises:
+        ValueError: If the size is not positive.
+    """
+    if size < 1:
+        raise ValueError(f"The channel pool size must be positive, not {size}.")
+
+    options: list[tuple[str, int]] = [("grpc.use_local_subchannel_pool", 1)]
+    if keepalive_time_ms is not None:
+        options.append(("grpc.keepalive_time_ms", keepalive_time_ms))
+    if credentials is None:
+        return [
+            grpc.aio.insecure_channel(svc_addr, options=options) for _ in range(size)
+        ]
+    return [
+        grpc.aio.secure_channel(svc_addr, credentials, options=options)
+        for _ in range(size)
+    ]
+
+
 class Client:
     """Weather forecast client."""
 
-    def __init__(self, grpc_channel: grpc.aio.Channel, svc_addr: str) -> None:
+    def __init__(
+        self,
+        grpc_channel: grpc.aio.Channel | Sequence[grpc.aio.Channel],
+        svc_addr: str,
+    ) -> None:
         """Initialize the client.
 
         Args:
-            grpc_channel: gRPC channel to use for communication with the API.
+            grpc_channel: gRPC channel to use for communication with the API, or
+                a pool of channels to the same service to spread the streams
+                over (see `make_channel_pool`).
             svc_addr: Address of the service to connect to.
+
+        Raises:
+            ValueError: If an empty pool of channels is given.
         """
+        channels = (
+            list(grpc_channel) if isinstance(grpc_channel, Sequence) else [grpc_channel]
+        )
+        if not channels:
+            raise ValueError("At least one gRPC channel is required.")
+
         self._svc_addr = svc_addr
-        self._stub = weather_pb2_grpc.WeatherForecastServiceStub(grpc_channel)
+        self._stubs = [
+            weather_pb2_grpc.WeatherForecastServiceStub(channel) for channel in channels
+        ]
+        self._next_stub = itertools.cycle(self._stubs)
         self._streams: dict[
-            tuple[Location | ForecastFeature, ...],
+            tuple[tuple[Location, ...], tuple[ForecastFeature, ...]],
             GrpcStreamBroadcaster[
                 weather_pb2.ReceiveLiveWeatherForecastResponse, Forecasts
             ],
@@ -47,12 +110,14 @@ class Client:
         Returns:
             A channel receiver for weather forecast data.
         """
-        stream_key = tuple(tuple(locations) + tuple(features))
+        stream_key = (tuple(locations), tuple(features))
 
         if stream_key not in self._streams:
+            # the same stream is always served by the same channel
+            stub = self._stubs[hash(stream_key) % len(self._stubs)]
             self._streams[stream_key] = GrpcStreamBroadcaster(
                 f"weather-forecast-{stream_key}",
-                lambda: self._stub.ReceiveLiveWeatherForecast(  # type:ignore
+                lambda: stub.ReceiveLiveWeatherForecast(  # type:ignore
                     weather_pb2.ReceiveLiveWeatherForecastRequest(
                         locations=(location.to_pb() for location in locations),
                         features=(feature.value for feature in features),
@@ -80,4 +145,6 @@ class Client:
         Returns:
             A channel receiver for weather forecast data.
         """
-        return HistoricalForecastIterator(self._stub, locations, features, start, end)
+        return HistoricalForecastIterator(
+            next(self._next_stub), locations, features, start, end
+        )
@@ -7,18 +7,32 @@ from __future__ import annotations  # required for constructor type hinting
 
 import datetime as dt
 import enum
+import itertools
 import logging
+import operator
 import typing
 from collections import namedtuple
-from dataclasses import dataclass
+from collections.abc import Iterator
+from dataclasses import dataclass, field
 
 import numpy as np
 from frequenz.api.common.v1 import location_pb2
 from frequenz.api.weather import weather_pb2
+from google.protobuf import timestamp_pb2
 
 # Set up logging
 _logger = logging.getLogger(__name__)
 
+_KeyT = typing.TypeVar("_KeyT", bound=typing.Hashable)
+
+_TO_NDARRAY_VLF_CACHE_SIZE = 16
+"""The number of filter combinations for which `to_ndarray_vlf` caches arrays."""
+
+_get_feature = operator.attrgetter("feature")
+_get_value = operator.attrgetter("value")
+_get_seconds = operator.attrgetter("seconds")
+_get_nanos = operator.attrgetter("nanos")
+
 
 class ForecastFeature(enum.Enum):
     """Weather forecast features available through the API."""
@@ -73,14 +87,14 @@ class ForecastFeature(enum.Enum):
         Returns:
             Enum value corresponding to the protobuf message.
         """
-        if not any(t.value == forecast_feature for t in ForecastFeature):
+        try:
+            return cls(forecast_feature)
+        except ValueError:
             _logger.warning(
                 "Unknown forecast feature %s. Returning UNSPECIFIED.", forecast_feature
             )
             return cls.UNSPECIFIED
 
-        return ForecastFeature(forecast_feature)
-
 
 @dataclass(frozen=True)
 class Location:
@@ -131,6 +145,20 @@ class Forecasts:
 
     _forecasts_pb: weather_pb2.ReceiveLiveWeatherForecastResponse
 
+    # The arrays returned by `to_ndarray_vlf` for the most recently used filters,
+    # from the least to the most recently used one.
+    _ndarray_vlf_cache: dict[
+        tuple[
+            tuple[dt.datetime, ...] | None,
+            tuple[Location, ...] | None,
+            tuple[ForecastFeature, ...] | None,
+        ],
+        np.ndarray[
+            tuple[typing.Any, typing.Any, typing.Any],
+            np.dtype[np.float64],
+        ],
+    ] = field(default_factory=dict, init=False, repr=False, compare=False)
+
     @classmethod
     def from_pb(
         cls, forecasts: weather_pb2.ReceiveLiveWeatherForecastResponse
@@ -145,7 +173,6 @@ class Forecasts:
         """
         return cls(_forecasts_pb=forecasts)
 
-    # pylint: disable=too-many-locals,too-many-branches,too-many-statements
     def to_ndarray_vlf(
         self,
         validity_times: list[dt.datetime] | None = None,
@@ -161,6 +188,14 @@ class Forecasts:
         """Convert a Forecast object to numpy array and use NaN to mark irrelevant data.
 
         If any of the filters are None, all values for that parameter will be returned.
+        Empty filters are rejected, as they would select no values at all.
+
+        The arrays for the most recently used filters are cached, so repeated calls
+        with the same filters only need to copy the cached array.
+
+        Requested validity times, locations and features without data are logged
+        as a warning when the array is created. This happens only on the first call
+        for a set of filters, not again while the array for them is cached.
 
         Args:
             validity_times: The validity times to filter by.
@@ -171,12 +206,83 @@ class Forecasts:
             Numpy array of shape (num_validity_times, num_locations, num_features)
 
         Raises:
-            ValueError: If the forecasts data is missing or invalid.
+            ValueError: If the forecasts data is missing or invalid, or any of the
+                filters is empty.
         """
         # check for empty forecasts data
         if not self._forecasts_pb.location_forecasts:
             raise ValueError("Forecast data is missing or invalid.")
 
+        for name, requested in (
+            ("validity times", validity_times),
+            ("locations", locations),
+            ("features", features),
+        ):
+            if requested is not None and not requested:
+                raise ValueError(
+                    f"The requested {name} must not be empty, use None to not filter "
+                    "by them."
+                )
+
+        key = (
+            tuple(validity_times) if validity_times is not None else None,
+            tuple(locations) if locations is not None else None,
+            tuple(features) if features is not None else None,
+        )
+        array = self._ndarray_vlf_cache.pop(key, None)
+        if array is None:
+            array = self._to_ndarray_vlf(*key)
+            if len(self._ndarray_vlf_cache) >= _TO_NDARRAY_VLF_CACHE_SIZE:
+                # evict the least recently used array
+                del self._ndarray_vlf_cache[next(iter(self._ndarray_vlf_cache))]
+        # (re)insert the array as the most recently used one
+        self._ndarray_vlf_cache[key] = array
+
+        # the cached array is copied, so callers can't modify the cached data
+        return array.copy()
+
+    def __getstate__(self) -> dict[str, typing.Any]:
+        """Get the state for pickling and copying, without the cached arrays.
+
+        Returns:
+            The attributes of the object, except for the cached arrays.
+        """
+        state = self.__dict__.copy()
+        del state["_ndarray_vlf_cache"]
+        return state
+
+    def __setstate__(self, state: dict[str, typing.Any]) -> None:
+        """Restore the state from pickling and copying, with an empty cache.
+
+        Args:
+            state: The attributes of the object, as returned by `__getstate__`.
+        """
+        self.__dict__.update(state)
+        self.__dict__["_ndarray_vlf_cache"] = {}
+
+    # pylint: disable-next=too-many-locals
+    def _to_ndarray_vlf(
+        self,
+        validity_times: tuple[dt.datetime, ...] | None,
+        locations: tuple[Location, ...] | None,
+        features: tuple[ForecastFeature, ...] | None,
+    ) -> np.ndarray[
+        tuple[typing.Any, typing.Any, typing.Any],
+        np.dtype[np.float64],
+    ]:
+        """Convert a Forecast object to numpy array and use NaN to mark irrelevant data.
+
+        Args:
+            validity_times: The validity times to filter by.
+            locations: The locations to filter by.
+            features: The features to filter by.
+
+        Returns:
+            Numpy array of shape (num_validity_times, num_locations, num_features)
+
+        Raises:
+            RuntimeError: If the forecasts data could not be processed.
+        """
         try:
             num_times = len(self._forecasts_pb.location_forecasts[0].forecasts)
             num_locations = len(self._forecasts_pb.location_forecasts)
@@ -184,118 +290,168 @@ class Forecasts:
                 self._forecasts_pb.location_forecasts[0].forecasts[0].features
             )
 
-            # Look for the proto indexes of the filtered times, locations and features
-            location_indexes = []
-            validity_times_indexes = []
-            feature_indexes = []
+            # Map each key in the proto to its index once, so that looking up the
+            # filtered times, locations and features is a dict lookup instead of a
+            # scan over the proto. Missing keys are remembered with index -1.
 
             # get the location indexes of the proto for the filtered locations
             if locations:
-                for location in locations:
-                    found = False
-                    for l_index, location_forecast in enumerate(
-                        self._forecasts_pb.location_forecasts
-                    ):
-                        if location == Location.from_pb(location_forecast.location):
-                            location_indexes.append(l_index)
-                            found = True
-                            break
-                    if not found:
-                        # remember position of missing location
-                        location_indexes.append(-1)
+                # compare plain tuples of the location fields, so that no Location
+                # needs to be created for the locations in the proto
+                location_to_index = _first_index_map(
+                    (
+                        location_forecast.location.latitude,
+                        location_forecast.location.longitude,
+                        location_forecast.location.country_code,
+                    )
+                    for location_forecast in self._forecasts_pb.location_forecasts
+                )
+                location_indexes = [
+                    location_to_index.get(
+                        (location.latitude, location.longitude, location.country_code),
+                        -1,
+                    )
+                    for location in locations
+                ]
             else:
                 location_indexes = list(range(num_locations))
 
             # get the val indexes of the proto for the filtered validity times
             if validity_times:
-                for req_validitiy_time in validity_times:
-                    found = False
-                    for t_index, val_time in enumerate(
-                        self._forecasts_pb.location_forecasts[0].forecasts
-                    ):
-                        if req_validitiy_time == val_time.valid_at_ts.ToDatetime():
-                            validity_times_indexes.append(t_index)
-                            found = True
-                            break
-                    if not found:
-                        # remember position of missing validity time
-                        validity_times_indexes.append(-1)
+                validity_time_to_index = _first_index_map(
+                    val_time.valid_at_ts.ToDatetime()
+                    for val_time in self._forecasts_pb.location_forecasts[0].forecasts
+                )
+                validity_times_indexes = [
+                    validity_time_to_index.get(req_validity_time, -1)
+                    for req_validity_time in validity_times
+                ]
             else:
                 validity_times_indexes = list(range(num_times))
 
             # get the feature indexes of the proto for the filtered features
             if features:
-                for req_feature in features:
-                    found = False
-                    for f_index, feature in enumerate(
-                        self._forecasts_pb.location_forecasts[0].forecasts[0].features
-                    ):
-                        if req_feature == ForecastFeature.from_pb(feature.feature):
-                            feature_indexes.append(f_index)
-                            found = True
-                            break
-                    if not found:
-                        # remember position of missing feature
-                        feature_indexes.append(-1)
+                feature_to_index = _first_index_map(
+                    ForecastFeature.from_pb(feature.feature)
+                    for feature in self._forecasts_pb.location_forecasts[0]
+                    .forecasts[0]
+                    .features
+                )
+                feature_indexes = [
+                    feature_to_index.get(req_feature, -1) for req_feature in features
+                ]
             else:
                 feature_indexes = list(range(num_features))
 
-            array = np.full(
-                (
-                    len(validity_times_indexes),
-                    len(location_indexes),
-                    len(feature_indexes),
-                ),
-                np.nan,
+            # The requested keys without data are left as NaN, but let the caller
+            # know about them
+            for name, requested, indexes in (
+                ("validity times", validity_times, validity_times_indexes),
+                ("locations", locations, location_indexes),
+                ("features", features, feature_indexes),
+            ):
+                if requested and -1 in indexes:
+                    _logger.warning(
+                        "Requested %s not found in the forecast data: %s",
+                        name,
+                        [key for key, index in zip(requested, indexes) if index < 0],
+                    )
+
+            # If none of the requested keys of a dimension was found, every cell is
+            # NaN and there is nothing to read from the proto
+            if any(
+                all(index < 0 for index in indexes)
+                for indexes in (
+                    validity_times_indexes,
+                    location_indexes,
+                    feature_indexes,
+                )
+            ):
+                return np.full(
+                    (
+                        len(validity_times_indexes),
+                        len(location_indexes),
+                        len(feature_indexes),
+                    ),
+                    np.nan,
+                )
+
+            # Collect all values in a single pass and let numpy copy them into the
+            # array at C level, instead of assigning one element at a time. Cells
+            # for which data is missing for at least one of the keys are set to NaN.
+            values = _iter_vlf_values(
+                self._forecasts_pb.location_forecasts,
+                location_indexes,
+                validity_times_indexes,
+                feature_indexes,
+            )
+            shape = (
+                len(location_indexes),
+                len(validity_times_indexes),
+                len(feature_indexes),
+            )
+            array = (
+                np.fromiter(values, dtype=np.float64, count=int(np.prod(shape)))
+                .reshape(shape)
+                .transpose(1, 0, 2)
             )
 
-            array_l_index = 0
+        # catch all exceptions
+        except Exception as e:
+            raise RuntimeError("Error processing forecast data") from e
 
-            for l_index in location_indexes:
-                array_t_index = 0
+        return array
 
-                for t_index in validity_times_indexes:
-                    array_f_index = 0
 
-                    for f_index in feature_indexes:
-                        # This fails if there was data missing for at least one of the
-                        # keys and we don't update the array but leave it as NaN
-                        if l_index >= 0 and t_index >= 0 and f_index >= 0:
-                            array[array_t_index, array_l_index, array_f_index] = (
-                                self._forecasts_pb.location_forecasts[l_index]
-                                .forecasts[t_index]
-                                .features[f_index]
-                                .value
-                            )
-                        array_f_index += 1
+def _first_index_map(keys: typing.Iterable[_KeyT]) -> dict[_KeyT, int]:
+    """Map each key to the index of its first occurrence.
 
-                    array_t_index += 1
+    Args:
+        keys: The keys to map.
 
-                array_l_index += 1
+    Returns:
+        Dictionary mapping each key to the index where it first appears.
+    """
+    index_map: dict[_KeyT, int] = {}
+    for index, key in enumerate(keys):
+        index_map.setdefault(key, index)
+    return index_map
 
-            # Check if the array shape matches the number of filtered times, locations
-            # and features
-            if validity_times is not None and array.shape[0] != len(validity_times):
-                raise ValueError(
-                    f"The count of validity times in the array({array.shape[0]}) does "
-                    f"not match the requested validity times count ({validity_times}."
-                )
-            if locations is not None and array.shape[1] != len(locations):
-                raise ValueError(
-                    f"The count of location in the array ({array.shape[1]}) does not "
-                    f"match the requested location count ({locations})."
-                )
-            if features is not None and array.shape[2] != len(features):
-                raise ValueError(
-                    f"The count of features in the array ({array.shape[2]}) does not "
-                    f"match the requested feature count ({features})."
-                )
 
-        # catch all exceptions
-        except Exception as e:
-            raise RuntimeError("Error processing forecast data") from e
+def _iter_vlf_values(
+    location_forecasts: typing.Sequence[weather_pb2.LocationForecast],
+    location_indexes: list[int],
+    validity_times_indexes: list[int],
+    feature_indexes: list[int],
+) -> Iterator[float]:
+    """Iterate over the forecast values in (location, time, feature) order.
 
-        return array
+    The location and time level messages are looked up once and reused for all
+    the values below them, instead of descending the proto for every value.
+
+    Args:
+        location_forecasts: The location forecasts to read the values from.
+        location_indexes: The proto indexes of the locations, -1 if missing.
+        validity_times_indexes: The proto indexes of the times, -1 if missing.
+        feature_indexes: The proto indexes of the features, -1 if missing.
+
+    Yields:
+        The forecast values, or NaN where any of the indexes is missing.
+    """
+    for l_index in location_indexes:
+        if l_index < 0:
+            yield from itertools.repeat(
+                np.nan, len(validity_times_indexes) * len(feature_indexes)
+            )
+            continue
+        forecasts = location_forecasts[l_index].forecasts
+        for t_index in validity_times_indexes:
+            if t_index < 0:
+                yield from itertools.repeat(np.nan, len(feature_indexes))
+                continue
+            features = forecasts[t_index].features
+            for f_index in feature_indexes:
+                yield features[f_index].value if f_index >= 0 else np.nan
 
 
 ForecastData = namedtuple(
@@ -303,6 +459,18 @@ ForecastData = namedtuple(
     ["creation_ts", "latitude", "longitude", "validity_ts", "feature", "value"],
 )
 
+FORECAST_DATA_DTYPE = np.dtype(
+    [
+        ("creation_ts", "datetime64[us]"),
+        ("latitude", np.float64),
+        ("longitude", np.float64),
+        ("validity_ts", "datetime64[us]"),
+        ("feature", np.int32),
+        ("value", np.float64),
+    ]
+)
+"""The numpy dtype of the rows returned by `flatten_to_ndarray`."""
+
 
 @dataclass(frozen=True)
 class HistoricalForecasts:
@@ -341,6 +509,24 @@ class HistoricalForecasts:
 
         return flatten(list(self._forecasts_pb.location_forecasts))
 
+    def flatten_to_ndarray(
+        self,
+    ) -> np.ndarray[tuple[typing.Any], np.dtype[np.void]]:
+        """Flatten a Forecast object to a numpy structured array.
+
+        Returns:
+            Structured array with the flattened forecast data, with one row per
+                forecast value and the columns described by `FORECAST_DATA_DTYPE`.
+
+        Raises:
+            ValueError: If the forecasts data is missing or invalid.
+        """
+        # check for empty forecasts data
+        if not self._forecasts_pb.location_forecasts:
+            raise ValueError("Forecast data is missing or invalid.")
+
+        return flatten_to_ndarray(list(self._forecasts_pb.location_forecasts))
+
 
 def flatten(
     location_forecasts: list[weather_pb2.LocationForecast],
@@ -360,20 +546,129 @@ def flatten(
     Returns:
         List of named tuples with the flattened forecast data.
     """
-    data = []
+    # allocate the whole list up front instead of growing it row by row
+    num_rows = sum(
+        len(forecasts.features)
+        for location_forecast in location_forecasts
+        for forecasts in location_forecast.forecasts
+    )
+    data: list[ForecastData | None] = [None] * num_rows
+    row = 0
+    # look the features up in a plain dict, unknown ones fall back to from_pb
+    feature_by_value = {feature.value: feature for feature in ForecastFeature}
     for location_forecast in location_forecasts:
+        # these are the same for all the rows of a location forecast
+        creation_ts = location_forecast.creation_ts.ToDatetime()
+        latitude = location_forecast.location.latitude
+        longitude = location_forecast.location.longitude
         for forecasts in location_forecast.forecasts:
+            validity_ts = forecasts.valid_at_ts.ToDatetime()
             for feature_forecast in forecasts.features:
-                # Create and append an instance of the named tuple instead of a plain tuple
-                data.append(
-                    ForecastData(
-                        creation_ts=location_forecast.creation_ts.ToDatetime(),
-                        latitude=location_forecast.location.latitude,
-                        longitude=location_forecast.location.longitude,
-                        validity_ts=forecasts.valid_at_ts.ToDatetime(),
-                        feature=ForecastFeature(feature_forecast.feature),
-                        value=feature_forecast.value,
-                    )
+                feature = feature_by_value.get(feature_forecast.feature)
+                if feature is None:
+                    feature = ForecastFeature.from_pb(feature_forecast.feature)
+                # Create an instance of the named tuple instead of a plain tuple
+                data[row] = ForecastData(
+                    creation_ts=creation_ts,
+                    latitude=latitude,
+                    longitude=longitude,
+                    validity_ts=validity_ts,
+                    feature=feature,
+                    value=feature_forecast.value,
                 )
+                row += 1
+
+    return typing.cast(list[ForecastData], data)
+
+
+def flatten_to_ndarray(
+    location_forecasts: list[weather_pb2.LocationForecast],
+) -> np.ndarray[tuple[typing.Any], np.dtype[np.void]]:
+    """Flatten a Forecast object to a numpy structured array.
+
+    This holds the same data as `flatten`, with one row per forecast value, but
+    each column is stored with a native numpy type (see `FORECAST_DATA_DTYPE`)
+    instead of as Python objects. The feature column holds the protobuf value of
+    the feature, which can be converted with `ForecastFeature.from_pb`.
+
+    Args:
+        location_forecasts: The location forecasts to flatten.
+    Returns:
+        Structured array with the flattened forecast data.
+    """
+    all_forecasts = [
+        forecasts
+        for location_forecast in location_forecasts
+        for forecasts in location_forecast.forecasts
+    ]
+    all_features = list(
+        itertools.chain.from_iterable(forecasts.features for forecasts in all_forecasts)
+    )
+    # number of rows of each time row and each location forecast
+    time_sizes = [len(forecasts.features) for forecasts in all_forecasts]
+    location_sizes = [
+        sum(len(forecasts.features) for forecasts in location_forecast.forecasts)
+        for location_forecast in location_forecasts
+    ]
+
+    # Fill each column at once. Values that are shared by all the rows of a
+    # location forecast or a time row are converted once and repeated by numpy.
+    data = np.empty(len(all_features), dtype=FORECAST_DATA_DTYPE)
+    data["creation_ts"] = np.repeat(
+        _timestamps_to_datetime64(
+            [location_forecast.creation_ts for location_forecast in location_forecasts]
+        ),
+        location_sizes,
+    )
+    data["latitude"] = np.repeat(
+        [
+            location_forecast.location.latitude
+            for location_forecast in location_forecasts
+        ],
+        location_sizes,
+    )
+    data["longitude"] = np.repeat(
+        [
+            location_forecast.location.longitude
+            for location_forecast in location_forecasts
+        ],
+        location_sizes,
+    )
+    data["validity_ts"] = np.repeat(
+        _timestamps_to_datetime64(
+            [forecasts.valid_at_ts for forecasts in all_forecasts]
+        ),
+        time_sizes,
+    )
+    data["feature"] = np.fromiter(
+        map(_get_feature, all_features), dtype=np.int32, count=len(all_features)
+    )
+    data["value"] = np.fromiter(
+        map(_get_value, all_features), dtype=np.float64, count=len(all_features)
+    )
 
     return data
+
+
+def _timestamps_to_datetime64(
+    timestamps: list[timestamp_pb2.Timestamp],
+) -> np.ndarray[tuple[typing.Any], np.dtype[np.datetime64]]:
+    """Convert protobuf timestamps to a numpy datetime64 array.
+
+    The conversion is done on the raw seconds and nanoseconds of the timestamps,
+    without creating a `datetime` object for each of them. Like
+    `Timestamp.ToDatetime`, the nanoseconds are truncated to microseconds.
+
+    Args:
+        timestamps: The timestamps to convert.
+
+    Returns:
+        Array of the timestamps with microsecond resolution.
+    """
+    seconds = np.fromiter(
+        map(_get_seconds, timestamps), dtype=np.int64, count=len(timestamps)
+    )
+    nanos = np.fromiter(
+        map(_get_nanos, timestamps), dtype=np.int64, count=len(timestamps)
+    )
+    return (seconds * 1_000_000 + nanos // 1_000).astype("datetime64[us]")
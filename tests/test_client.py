@@ -0,0 +1,150 @@
+# License: MIT
+# Copyright © 2024 Frequenz Energy-as-a-Service GmbH
+
+"""Test the client module."""
+
+# The tests need to look at the stubs and streams of the client.
+# pylint: disable=protected-access
+
+import asyncio
+from datetime import datetime
+from typing import Any
+from unittest import mock
+
+import pytest
+from frequenz.client.weather import Client, ForecastFeature, Location, make_channel_pool
+
+SVC_ADDR = "localhost:50051"
+
+LOCATIONS = [
+    Location(latitude=42.0, longitude=18.0, country_code="US"),
+    Location(latitude=43.0, longitude=19.0, country_code="CA"),
+]
+FEATURES = [
+    ForecastFeature.U_WIND_COMPONENT_100_METRE,
+    ForecastFeature.V_WIND_COMPONENT_100_METRE,
+]
+
+
+def _make_client(num_channels: int) -> tuple[Client, list[mock.MagicMock]]:
+    """Create a client with a pool of mock channels and a mock stub per channel.
+
+    Args:
+        num_channels: The number of channels in the pool.
+
+    Returns:
+        The created client and its mock stubs, in the order of the channels.
+    """
+    stubs = [mock.MagicMock(name=f"stub-{i}") for i in range(num_channels)]
+    with mock.patch(
+        "frequenz.client.weather._client.weather_pb2_grpc.WeatherForecastServiceStub",
+        side_effect=stubs,
+    ):
+        client = Client(
+            [mock.MagicMock(name=f"channel-{i}") for i in range(num_channels)],
+            SVC_ADDR,
+        )
+    return client, stubs
+
+
+def _stream_stub_index(
+    client: Client,
+    stubs: list[mock.MagicMock],
+    locations: list[Location],
+    features: list[ForecastFeature],
+) -> int:
+    """Open a live forecast stream and get the index of the stub that it uses.
+
+    Args:
+        client: The client to open the stream with.
+        stubs: The mock stubs of the client.
+        locations: The locations to stream data for.
+        features: The features to stream data for.
+
+    Returns:
+        The index of the stub whose ReceiveLiveWeatherForecast method the stream
+            calls.
+    """
+    for stub in stubs:
+        stub.reset_mock()
+
+    with mock.patch(
+        "frequenz.client.weather._client.GrpcStreamBroadcaster"
+    ) as broadcaster_cls:
+        asyncio.run(client.stream_live_forecast(locations, features))
+
+    # call the stream method passed to the broadcaster and find the stub it used
+    _, stream_method, _ = broadcaster_cls.call_args.args
+    stream_method()
+    (index,) = [
+        index
+        for index, stub in enumerate(stubs)
+        if stub.ReceiveLiveWeatherForecast.called
+    ]
+    return index
+
+
+def test_make_channel_pool_invalid_size() -> None:
+    """Test if creating a channel pool without channels fails."""
+    with pytest.raises(ValueError):
+        make_channel_pool(SVC_ADDR, 0)
+
+
+def test_client_without_channels() -> None:
+    """Test if creating a client with an empty channel pool fails."""
+    with pytest.raises(ValueError):
+        Client([], SVC_ADDR)
+
+
+def test_client_single_channel() -> None:
+    """Test if a client with a single channel has a single stub."""
+    client = Client(mock.MagicMock(), SVC_ADDR)
+
+    assert len(client._stubs) == 1
+
+
+def test_hist_forecast_iterator_round_robin() -> None:
+    """Test if historical forecast iterators take the stubs in turn."""
+    client, stubs = _make_client(3)
+    start = datetime(2024, 1, 1)
+    end = datetime(2024, 1, 2)
+
+    used_stubs = [
+        client.hist_forecast_iterator(LOCATIONS, FEATURES, start, end)._stub
+        for _ in range(6)
+    ]
+
+    assert used_stubs == stubs * 2
+
+
+def test_stream_live_forecast_same_stub() -> None:
+    """Test if the same stream key is always served by the same stub."""
+    num_channels = 3
+    client, stubs = _make_client(num_channels)
+    other_client, other_stubs = _make_client(num_channels)
+
+    for num_locations in range(len(LOCATIONS) + 1):
+        for num_features in range(len(FEATURES) + 1):
+            locations = LOCATIONS[:num_locations]
+            features = FEATURES[:num_features]
+
+            assert _stream_stub_index(
+                client, stubs, locations, features
+            ) == _stream_stub_index(other_client, other_stubs, locations, features)
+
+
+def test_stream_live_forecast_separate_keys() -> None:
+    """Test if different locations and features don't share a stream key."""
+    client, _ = _make_client(1)
+    location_a, location_b = LOCATIONS
+    feature_c = ForecastFeature.TEMPERATURE_2_METRE
+    # a feature and a location would end up in the same position of a flat key
+    location_as_feature: Any = location_b
+
+    with mock.patch("frequenz.client.weather._client.GrpcStreamBroadcaster"):
+        asyncio.run(client.stream_live_forecast([location_a, location_b], [feature_c]))
+        asyncio.run(
+            client.stream_live_forecast([location_a], [location_as_feature, feature_c])
+        )
+
+    assert len(client._streams) == 2
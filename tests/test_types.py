@@ -9,15 +9,26 @@
 # pylint doesn't understand the imports from the generated proto modules.
 # pylint: disable=no-name-in-module,no-member
 
+import copy
+import gc
+import pickle
+import weakref
 from datetime import datetime
 
 import numpy as np
 from _pytest.logging import LogCaptureFixture
 from frequenz.api.common.v1.location_pb2 import Location as LocationProto
 from frequenz.api.weather import weather_pb2
-from frequenz.client.weather._types import ForecastFeature, Forecasts, Location
+from frequenz.client.weather._types import (
+    _TO_NDARRAY_VLF_CACHE_SIZE,
+    FORECAST_DATA_DTYPE,
+    ForecastFeature,
+    Forecasts,
+    HistoricalForecasts,
+    Location,
+)
 from google.protobuf.timestamp_pb2 import Timestamp
-from pytest import fixture
+from pytest import fixture, raises
 
 
 class TestForecastFeatureType:
@@ -293,11 +304,120 @@ class TestForecasts:
         assert isinstance(array, np.ndarray)
         assert array.shape == (len(validity_times), len(locations), len(features))
 
+    def test_to_ndarray_vlf_repeated_calls(
+        self,
+        forecastdata: tuple[
+            weather_pb2.ReceiveLiveWeatherForecastResponse, int, int, int
+        ],
+    ) -> None:
+        """Test if repeated calls with the same filters return independent arrays."""
+        forecasts_proto, num_times, num_locations, num_features = forecastdata
+        forecasts = Forecasts.from_pb(forecasts_proto)
+
+        features = [ForecastFeature.V_WIND_COMPONENT_100_METRE]
+
+        array = forecasts.to_ndarray_vlf(features=features)
+        expected = array.copy()
+        array[:] = -1
+
+        # modifying a returned array doesn't change the following results
+        np.testing.assert_array_equal(
+            forecasts.to_ndarray_vlf(features=features), expected
+        )
+        assert forecasts.to_ndarray_vlf().shape == (
+            num_times,
+            num_locations,
+            num_features,
+        )
+
+    def test_to_ndarray_vlf_cache_eviction(
+        self,
+        forecastdata: tuple[
+            weather_pb2.ReceiveLiveWeatherForecastResponse, int, int, int
+        ],
+    ) -> None:
+        """Test if only the arrays of the most recently used filters are cached."""
+        forecasts_proto, _, _, _ = forecastdata
+        forecasts = Forecasts.from_pb(forecasts_proto)
+
+        times = [datetime(2024, 1, 1, hour) for hour in range(20)]
+        for time in times:
+            forecasts.to_ndarray_vlf(validity_times=[time])
+        # using the first array again makes the second one the least recently used
+        forecasts.to_ndarray_vlf(validity_times=[times[0]])
+        forecasts.to_ndarray_vlf()
+
+        # pylint: disable-next=protected-access
+        cached_keys = list(forecasts._ndarray_vlf_cache)
+        assert len(cached_keys) == _TO_NDARRAY_VLF_CACHE_SIZE
+        assert cached_keys[-1] == (None, None, None)
+        assert cached_keys[-2] == ((times[0],), None, None)
+        assert ((times[1],), None, None) not in cached_keys
+
+    def test_to_ndarray_vlf_pickle_and_copy(
+        self,
+        forecastdata: tuple[
+            weather_pb2.ReceiveLiveWeatherForecastResponse, int, int, int
+        ],
+    ) -> None:
+        """Test if the object can be pickled and copied after caching an array."""
+        forecasts_proto, _, _, _ = forecastdata
+        forecasts = Forecasts.from_pb(forecasts_proto)
+        array = forecasts.to_ndarray_vlf()
+
+        for other in (
+            pickle.loads(pickle.dumps(forecasts)),
+            copy.copy(forecasts),
+            copy.deepcopy(forecasts),
+        ):
+            assert other == forecasts
+            # the cached arrays are not carried over
+            # pylint: disable-next=protected-access
+            assert not other._ndarray_vlf_cache
+            np.testing.assert_array_equal(other.to_ndarray_vlf(), array)
+
+    def test_to_ndarray_vlf_freed_without_gc(
+        self,
+        forecastdata: tuple[
+            weather_pb2.ReceiveLiveWeatherForecastResponse, int, int, int
+        ],
+    ) -> None:
+        """Test if the cache doesn't keep the object alive until the GC runs."""
+        forecasts_proto, _, _, _ = forecastdata
+        forecasts = Forecasts.from_pb(forecasts_proto)
+        forecasts.to_ndarray_vlf()
+        forecasts_ref = weakref.ref(forecasts)
+
+        gc.disable()
+        try:
+            del forecasts
+            assert forecasts_ref() is None
+        finally:
+            gc.enable()
+
+    def test_to_ndarray_vlf_with_empty_parameters(
+        self,
+        forecastdata: tuple[
+            weather_pb2.ReceiveLiveWeatherForecastResponse, int, int, int
+        ],
+    ) -> None:
+        """Test if the to_ndarray method rejects empty filter parameters."""
+        forecasts_proto, _, _, _ = forecastdata
+        forecasts = Forecasts.from_pb(forecasts_proto)
+
+        with raises(ValueError, match="validity times must not be empty"):
+            forecasts.to_ndarray_vlf(validity_times=[])
+        with raises(ValueError, match="locations must not be empty"):
+            forecasts.to_ndarray_vlf(locations=[])
+        with raises(ValueError, match="features must not be empty"):
+            forecasts.to_ndarray_vlf(features=[])
+
     def test_to_ndarray_vlf_with_missing_parameters(
         self,
         forecastdata: tuple[
             weather_pb2.ReceiveLiveWeatherForecastResponse, int, int, int
         ],
+        caplog: LogCaptureFixture,
     ) -> None:
         """Test if the to_ndarray method works correctly when filter parameters are missing."""
         # create an example Forecasts object with 3 times, 2 locations and 4 features
@@ -331,6 +451,15 @@ class TestForecasts:
             len(locations),
             len(features),
         )
+        assert "Requested locations not found in the forecast data" in caplog.text
+        assert "Requested features not found in the forecast data" in caplog.text
+
+        # the warning is not repeated while the array is cached
+        caplog.clear()
+        forecasts.to_ndarray_vlf(
+            validity_times=validity_times, locations=locations, features=features
+        )
+        assert "not found in the forecast data" not in caplog.text
         assert np.isnan(array[:, 0, :]).all()
         assert np.isnan(array[2, :, :]).all()
         assert np.isnan(array[:, :, 3]).all()
@@ -360,3 +489,109 @@ class TestForecasts:
         assert array[2, 1, 0] == 110
         assert array[2, 1, 1] == 111
         assert array[2, 1, 2] == 112
+
+        # None of the requested locations has data
+        locations = [Location(latitude=50.0, longitude=18.0, country_code="US")]
+        array = forecasts.to_ndarray_vlf(
+            validity_times=validity_times, locations=locations, features=features
+        )
+        assert array.shape == (len(validity_times), len(locations), len(features))
+        assert np.isnan(array).all()
+
+
+class TestHistoricalForecasts:
+    """Testing the HistoricalForecasts type."""
+
+    def test_flatten_to_ndarray(
+        self,
+        forecastdata: tuple[
+            weather_pb2.ReceiveLiveWeatherForecastResponse, int, int, int
+        ],
+    ) -> None:
+        """Test if flatten_to_ndarray matches the rows returned by flatten."""
+        forecasts_proto, num_times, num_locations, num_features = forecastdata
+        forecasts = HistoricalForecasts.from_pb(
+            weather_pb2.GetHistoricalWeatherForecastResponse(
+                location_forecasts=forecasts_proto.location_forecasts
+            )
+        )
+
+        rows = forecasts.flatten()
+        array = forecasts.flatten_to_ndarray()
+
+        assert array.dtype == FORECAST_DATA_DTYPE
+        assert array.shape == (num_times * num_locations * num_features,)
+        assert len(rows) == len(array)
+        for row, array_row in zip(rows, array):
+            assert array_row["creation_ts"] == np.datetime64(row.creation_ts)
+            assert array_row["latitude"] == row.latitude
+            assert array_row["longitude"] == row.longitude
+            assert array_row["validity_ts"] == np.datetime64(row.validity_ts)
+            assert ForecastFeature.from_pb(array_row["feature"]) == row.feature
+            assert array_row["value"] == row.value
+
+    def test_flatten_unknown_feature(self, caplog: LogCaptureFixture) -> None:
+        """Test if flatten maps unknown features to UNSPECIFIED."""
+        unknown_pb_value = 999999999  # a random unknown value
+        forecasts = HistoricalForecasts.from_pb(
+            weather_pb2.GetHistoricalWeatherForecastResponse(
+                location_forecasts=[
+                    weather_pb2.LocationForecast(
+                        forecasts=[
+                            weather_pb2.LocationForecast.Forecasts(
+                                features=[
+                                    weather_pb2.LocationForecast.Forecasts.FeatureForecast(
+                                        feature=unknown_pb_value,  # type: ignore
+                                        value=1.0,
+                                    )
+                                ]
+                            )
+                        ],
+                        location=LocationProto(
+                            latitude=42.0, longitude=18.0, country_code="US"
+                        ),
+                    )
+                ]
+            )
+        )
+
+        rows = forecasts.flatten()
+
+        assert len(rows) == 1
+        assert rows[0].feature == ForecastFeature.UNSPECIFIED
+        assert rows[0].value == 1.0
+        assert "Unknown forecast feature" in caplog.text
+
+    def test_flatten_to_ndarray_sub_microsecond_timestamps(self) -> None:
+        """Test if timestamps are truncated to microseconds like ToDatetime."""
+        creation_ts = Timestamp(seconds=1704067200, nanos=123_456_789)
+        valid_ts = Timestamp(seconds=-5, nanos=999_999_999)
+        forecasts = HistoricalForecasts.from_pb(
+            weather_pb2.GetHistoricalWeatherForecastResponse(
+                location_forecasts=[
+                    weather_pb2.LocationForecast(
+                        forecasts=[
+                            weather_pb2.LocationForecast.Forecasts(
+                                valid_at_ts=valid_ts,
+                                features=[
+                                    weather_pb2.LocationForecast.Forecasts.FeatureForecast(
+                                        feature=ForecastFeature.TEMPERATURE_2_METRE.value,
+                                        value=1.0,
+                                    )
+                                ],
+                            )
+                        ],
+                        location=LocationProto(
+                            latitude=42.0, longitude=18.0, country_code="US"
+                        ),
+                        creation_ts=creation_ts,
+                    )
+                ]
+            )
+        )
+
+        array = forecasts.flatten_to_ndarray()
+
+        assert array["creation_ts"][0] == np.datetime64(creation_ts.ToDatetime())
+        assert array["validity_ts"][0] == np.datetime64(valid_ts.ToDatetime())
+        assert array["creation_ts"][0] == np.datetime64("2024-01-01T00:00:00.123456")